@@ -1,20 +1,117 @@
+import asyncio
+import functools
 import os
+import ssl
+import aiohttp
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from openfga_sdk import ClientConfiguration, OpenFgaClient
 from openfga_sdk.credentials import Credentials, CredentialConfiguration
 
-def get_fga_client() -> OpenFgaClient:
+from filehub.core.fga.loop import get_fga_loop
+
+# Read once at import; the configuration built from them is cached by _get_fga_config().
+_FGA_API_TOKEN = os.environ.get("FGA_API_TOKEN")
+_FGA_API_URL = os.environ.get("FGA_API_URL")
+_FGA_STORE_ID = os.environ.get("FGA_STORE_ID")
+_FGA_AUTHZ_MODEL_ID = os.environ.get("FGA_AUTHZ_MODEL_ID")
+
+# The single client, created on the shared FGA loop (see get_fga_loop()); its aiohttp
+# session is bound to that loop, so it must only be used from coroutines running there.
+_client: OpenFgaClient | None = None
+
+
+def _build_session(config: ClientConfiguration) -> aiohttp.ClientSession:
+    """
+    Build the aiohttp session used for OpenFGA calls, with a keep-alive pool sized
+    from settings instead of the SDK's untuned default connector.
+    """
+    ssl_context = ssl.create_default_context(cafile=config.ssl_ca_cert)
+    if config.cert_file:
+        ssl_context.load_cert_chain(config.cert_file, keyfile=config.key_file)
+    if not config.verify_ssl:
+        ssl_context.check_hostname = False
+        ssl_context.verify_mode = ssl.CERT_NONE
+
+    connector = aiohttp.TCPConnector(
+        limit=settings.FGA_CONNECTION_POOL_LIMIT,
+        limit_per_host=settings.FGA_CONNECTION_POOL_LIMIT_PER_HOST,
+        keepalive_timeout=settings.FGA_KEEPALIVE_TIMEOUT,
+        ssl=ssl_context,
+    )
+    return aiohttp.ClientSession(connector=connector, trust_env=True)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_fga_config() -> ClientConfiguration:
+    """
+    Build the credentials and client configuration once; every client reuses them.
+    """
+    missing = [
+        name for name, value in (
+            ("FGA_API_TOKEN", _FGA_API_TOKEN),
+            ("FGA_API_URL", _FGA_API_URL),
+            ("FGA_STORE_ID", _FGA_STORE_ID),
+            ("FGA_AUTHZ_MODEL_ID", _FGA_AUTHZ_MODEL_ID),
+        )
+        if not value
+    ]
+    if missing:
+        raise ImproperlyConfigured(f"Missing OpenFGA environment variables: {', '.join(missing)}")
+
     credentials = Credentials(
         method="api_token",
         configuration=CredentialConfiguration(
-            api_token=os.environ["FGA_API_TOKEN"]
+            api_token=_FGA_API_TOKEN
         )
     )
 
-    config = ClientConfiguration(
-        api_url=os.environ["FGA_API_URL"],
-        store_id=os.environ["FGA_STORE_ID"],
-        authorization_model_id=os.environ["FGA_AUTHZ_MODEL_ID"],
+    return ClientConfiguration(
+        api_url=_FGA_API_URL,
+        store_id=_FGA_STORE_ID,
+        authorization_model_id=_FGA_AUTHZ_MODEL_ID,
         credentials=credentials,
     )
 
-    return OpenFgaClient(config)
+
+def _build_fga_client() -> OpenFgaClient:
+    return OpenFgaClient(_get_fga_config())
+
+
+async def get_fga_client() -> OpenFgaClient:
+    """
+    Return the process-wide OpenFgaClient, creating it on first use.
+    Must be awaited from the shared FGA loop (i.e. inside run_async/submit_async).
+    """
+    global _client
+    if asyncio.get_running_loop() is not get_fga_loop():
+        raise RuntimeError("get_fga_client() must run on the shared FGA loop; use run_async().")
+    if _client is None:
+        client = _build_fga_client()
+        # The SDK exposes no hook for the connector, so swap in our pooled session
+        # and release the default one it opened in the constructor.
+        rest_client = client._api_client.rest_client
+        default_session = rest_client.pool_manager
+        rest_client.pool_manager = _build_session(client._client_configuration)
+        _client = client
+        await default_session.close()
+    return _client
+
+
+def shutdown_fga_client() -> None:
+    """
+    Close the client on the shared loop. Registered with atexit from FilesConfig.ready().
+    """
+    global _client
+    if _client is not None:
+        asyncio.run_coroutine_threadsafe(_client.close(), get_fga_loop()).result(timeout=5)
+        _client = None
+
+
+def _reset_after_fork() -> None:
+    # The client's session belongs to the parent's loop thread, which does not survive fork().
+    global _client
+    _client = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
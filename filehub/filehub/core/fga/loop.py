@@ -0,0 +1,49 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import Future
+
+# A single event loop, running on a daemon thread, that every sync wrapper submits its
+# OpenFGA coroutines to. It owns the one OpenFgaClient (see get_fga_client()), so the
+# client and its pooled connections live as long as the process, and no loop is built
+# per call like async_to_sync does.
+_loop: asyncio.AbstractEventLoop | None = None
+_lock = threading.Lock()
+
+
+def get_fga_loop() -> asyncio.AbstractEventLoop:
+    """
+    Return the shared OpenFGA event loop, starting its thread on first use.
+    """
+    global _loop
+    if _loop is None:
+        with _lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="fga-event-loop", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def submit_async(coro) -> Future:
+    """
+    Schedule `coro` on the shared loop without waiting for it.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_fga_loop())
+
+
+def run_async(coro):
+    """
+    Run `coro` on the shared loop and block until it finishes; exceptions propagate to the caller.
+    """
+    return submit_async(coro).result()
+
+
+def _reset_after_fork() -> None:
+    # The loop thread does not survive fork(); a child starts its own on first use.
+    global _loop, _lock
+    _loop = None
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -6,3 +6,14 @@ class FGARelation(str, Enum):
     EDITOR = "editor"
     CAN_VIEW = "can_view"
     CAN_EDIT = "can_edit"
+
+
+# Every relation on the file type, in declaration order.
+ALL_RELATIONS = [r.value for r in FGARelation]
+
+# Plain-str relation names for hot paths, so callers skip the enum member lookup.
+OWNER = FGARelation.OWNER.value
+VIEWER = FGARelation.VIEWER.value
+EDITOR = FGARelation.EDITOR.value
+CAN_VIEW = FGARelation.CAN_VIEW.value
+CAN_EDIT = FGARelation.CAN_EDIT.value
@@ -159,3 +159,32 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
+
+
+# OpenFGA client
+# Connection pool shared by every OpenFGA call made from one event loop.
+
+FGA_CONNECTION_POOL_LIMIT = int(os.environ.get("FGA_CONNECTION_POOL_LIMIT", 100))
+FGA_CONNECTION_POOL_LIMIT_PER_HOST = int(os.environ.get("FGA_CONNECTION_POOL_LIMIT_PER_HOST", 32))
+FGA_KEEPALIVE_TIMEOUT = float(os.environ.get("FGA_KEEPALIVE_TIMEOUT", 75))
+
+# OpenFGA rejects write requests carrying more tuples than its maxTuplesPerWrite (100 by default).
+FGA_MAX_TUPLES_PER_WRITE = int(os.environ.get("FGA_MAX_TUPLES_PER_WRITE", 100))
+# How many of those write requests may be in flight at once for one bulk write.
+FGA_MAX_PARALLEL_WRITES = int(os.environ.get("FGA_MAX_PARALLEL_WRITES", 10))
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Use a shared backend (e.g. django.core.cache.backends.redis.RedisCache) when running
+# more than one process, so permission ETags are invalidated across all of them.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('DJANGO_CACHE_LOCATION', ''),
+    }
+}
+
+# Seconds a file's permissions ETag and cached permission lists stay valid.
+FGA_PERMISSIONS_CACHE_TTL = int(os.environ.get("FGA_PERMISSIONS_CACHE_TTL", 60))
@@ -1,6 +1,12 @@
+import atexit
 from django.apps import AppConfig
 
 
 class FilesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'files'
+
+    def ready(self):
+        from filehub.core.fga.client import shutdown_fga_client
+
+        atexit.register(shutdown_fga_client)
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.9 on 2026-10-15 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['created_at'], name='files_file_created_at_idx'),
+        ),
+    ]
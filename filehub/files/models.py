@@ -1,5 +1,6 @@
 import uuid
 from django.db import models
+from django.utils.functional import cached_property
 
 class File(models.Model):
     id = models.BigAutoField(primary_key=True)
@@ -10,6 +11,14 @@ class File(models.Model):
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["created_at"], name="files_file_created_at_idx"),
+        ]
 
     def __str__(self):
-        return f"{self.uuid}"
\ No newline at end of file
+        return f"{self.uuid}"
+
+    @cached_property
+    def fga_id(self) -> str:
+        """OpenFGA object identifier, formatted once per instance."""
+        return f"file:{self.uuid}"
@@ -2,6 +2,9 @@ from rest_framework import serializers
 from .models import File
 from filehub.core.fga.relations import FGARelation
 
+
+_FGA_RELATION_CHOICES = tuple((r.value, r.value) for r in FGARelation)
+
 class FileSerializer(serializers.ModelSerializer):
     uuid = serializers.UUIDField(read_only=True)
     created_at = serializers.DateTimeField(read_only=True)
@@ -20,7 +23,7 @@ class FileSerializer(serializers.ModelSerializer):
 
 class FileShareItemSerializer(serializers.Serializer):
     user_id = serializers.CharField()
-    relation = serializers.ChoiceField(choices=[r.value for r in FGARelation])
+    relation = serializers.ChoiceField(choices=_FGA_RELATION_CHOICES)
 
 class FileShareSerializer(serializers.Serializer):
     permissions = FileShareItemSerializer(many=True)
@@ -1,44 +1,84 @@
+import asyncio
 import logging
-from asgiref.sync import async_to_sync
+import uuid
 from rest_framework.exceptions import APIException
-from openfga_sdk import UserTypeFilter
+from openfga_sdk import OpenFgaClient, ReadRequestTupleKey, UserTypeFilter
 from openfga_sdk.rest import ApiException
 from openfga_sdk.client.models import (
     ClientListObjectsRequest, 
     ClientTuple, 
     ClientWriteRequest, 
-    ClientCheckRequest, 
-    ClientListRelationsRequest
+    ClientBatchCheckItem,
+    ClientBatchCheckRequest,
+    WriteTransactionOpts,
+)
+from openfga_sdk.client.models.write_conflict_opts import (
+    ConflictOptions,
+    ClientWriteRequestOnMissingDeletes,
 )
 from openfga_sdk.models.fga_object import FgaObject
 from openfga_sdk.client.models.list_users_request import ClientListUsersRequest
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connections, transaction
+from django.db.models.expressions import RawSQL
 
 from .models import File
 from filehub.core.fga.client import get_fga_client 
-from filehub.core.fga.relations import FGARelation
+from filehub.core.fga.loop import run_async, submit_async
+from filehub.core.fga.relations import ALL_RELATIONS, CAN_VIEW, OWNER
 
 
 User = get_user_model()
 
 logger = logging.getLogger(__name__)
 
+# Above this many UUIDs, _filter_by_uuids switches from an inline IN list to an array join.
+_LARGE_UUID_SET_THRESHOLD = 500
+
+# Tuples requested per page when reading a file's stored tuples.
+_FGA_READ_PAGE_SIZE = 100
+
 
 # -----------------------
 # Helpers
 # -----------------------
-def _fga_user_id(user) -> str:
+def _fga_user_id(user_id) -> str:
     """
-    Map Django user -> OpenFGA user identifier.
+    Map a Django user id -> OpenFGA user identifier.
     """
-    return f"user:{user.id}"
+    return f"user:{user_id}"
 
 
 def _fga_file_id(file: File) -> str:
     """
     Map File model -> OpenFGA object identifier.
     """
-    return f"file:{file.uuid}"
+    return file.fga_id
+
+
+def _request_fga_cache(request) -> dict:
+    """
+    Return the dict used to memoize OpenFGA lookups for the lifetime of one request.
+    """
+    cache = getattr(request, "_fga_cache", None)
+    if cache is None:
+        cache = request._fga_cache = {}
+    return cache
+
+
+def _filter_by_uuids(queryset, uuids):
+    """
+    Filter `queryset` to the given file UUIDs.
+    On PostgreSQL, large sets are sent as one uuid[] parameter and joined via unnest()
+    instead of inlining one placeholder per UUID, so the query size stays constant.
+    """
+    uuids = list(uuids)
+    if len(uuids) > _LARGE_UUID_SET_THRESHOLD and connections[queryset.db].vendor == "postgresql":
+        return queryset.filter(uuid__in=RawSQL("SELECT unnest(%s::uuid[])", (uuids,)))
+    return queryset.filter(uuid__in=uuids)
 
 
 def _handle_api_exception(exc: ApiException, context_msg: str = ""):
@@ -63,85 +103,211 @@ def update_file(*, file_instance: File, file_obj=None) -> File:
         file_instance.save()
     return file_instance
 
-async def fga_delete_file_tuple_async(*, file: File):
-    client = get_fga_client()
-    body = ClientWriteRequest(
-        deletes=[
-            ClientTuple(
-            user="user:*",
-            relation=FGARelation.OWNER.value,
-            object=_fga_file_id(file)
-        ),
-        ClientTuple(user="*", relation=FGARelation.VIEWER.value, object=_fga_file_id(file)),
-        ]
-    )
-    await client.write(body)
+async def _fga_read_file_tuples_async(file: File, client: OpenFgaClient | None = None) -> list[ClientTuple]:
+    """
+    Return every tuple stored with the file as its object, following continuation tokens.
+    """
+    client = client or await get_fga_client()
+    tuples = []
+    continuation_token = None
+    while True:
+        options = {"page_size": _FGA_READ_PAGE_SIZE}
+        if continuation_token:
+            options["continuation_token"] = continuation_token
+        try:
+            resp = await client.read(ReadRequestTupleKey(object=_fga_file_id(file)), options)
+        except ApiException as exc:
+            _handle_api_exception(exc, "fga_read_file_tuples")
+        tuples.extend(
+            ClientTuple(user=t.key.user, relation=t.key.relation, object=t.key.object)
+            for t in resp.tuples or []
+        )
+        continuation_token = resp.continuation_token
+        if not continuation_token:
+            return tuples
+
+
+async def _fga_delete_non_owner_tuples_async(
+    *, file: File, client: OpenFgaClient | None = None
+) -> list[ClientTuple]:
+    """
+    Delete the file's stored tuples except the owner ones, which are returned for the caller
+    to delete once everything else has succeeded.
+    """
+    client = client or await get_fga_client()
+    tuples = await _fga_read_file_tuples_async(file=file, client=client)
+    owners = [t for t in tuples if t.relation == OWNER]
+    others = [t for t in tuples if t.relation != OWNER]
+    if others:
+        await _fga_apply_write_tuples_async(deletes=others, ignore_missing_deletes=True, client=client)
+    return owners
+
 
 def delete_file(*, file_instance: File) -> None:
-    async_to_sync(fga_delete_file_tuple_async)(file=file_instance)
-    file_instance.delete()
+    """
+    Delete the file row and its shared tuples concurrently, then the owner tuples.
+    The row delete is rolled back if removing the tuples fails; the owner tuples are only
+    removed once the row delete and the other tuple deletes have succeeded, so a failure
+    never leaves a file without an owner.
+    """
+    with transaction.atomic():
+        fga_delete = submit_async(_fga_delete_non_owner_tuples_async(file=file_instance))
+        try:
+            try:
+                file_instance.delete()
+            finally:
+                owners = fga_delete.result()
+            if owners:
+                run_async(_fga_apply_write_tuples_async(deletes=owners, ignore_missing_deletes=True))
+        finally:
+            bump_fga_permissions_version(file_instance.uuid)
 
 
 
+# -----------------------
+# Permissions version (ETag support)
+# -----------------------
+def _fga_permissions_version_key(file_uuid) -> str:
+    return f"fga:permissions-version:{file_uuid}"
+
+
+def fga_permissions_version(file_uuid) -> str:
+    """
+    Return an opaque token that changes whenever the file's tuples are changed through this app.
+    It expires after FGA_PERMISSIONS_CACHE_TTL so changes made outside the app are picked up too.
+    """
+    key = _fga_permissions_version_key(file_uuid)
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(key, version, settings.FGA_PERMISSIONS_CACHE_TTL):
+            # Another request stored one first; use theirs.
+            version = cache.get(key) or version
+    return version
+
+
+def peek_fga_permissions_version(file_uuid) -> str | None:
+    """
+    Return the file's current permissions version without creating one. Safe to call
+    before the file is known to exist, e.g. when computing an ETag.
+    """
+    return cache.get(_fga_permissions_version_key(file_uuid))
+
+
+def bump_fga_permissions_version(file_uuid) -> None:
+    """Invalidate ETags and cached permission lists for the file."""
+    cache.delete(_fga_permissions_version_key(file_uuid))
+
+
 # -----------------------
 # Basic permission checks
 # -----------------------
-async def _fga_check_async(user, relation: str, file: File) -> bool:
-    client = get_fga_client()
-    body = ClientCheckRequest(
-        user=_fga_user_id(user),
-        relation=relation,
-        object=_fga_file_id(file)
+async def _fga_batch_check_async(
+    user, file: File, relations: list[str], client: OpenFgaClient | None = None
+) -> dict[str, bool]:
+    client = client or await get_fga_client()
+    body = ClientBatchCheckRequest(
+        checks=[
+            ClientBatchCheckItem(
+                user=_fga_user_id(user.id),
+                relation=relation,
+                object=_fga_file_id(file),
+            )
+            for relation in relations
+        ]
     )
     try:
-        resp = await client.check(body)
+        resp = await client.batch_check(body)
     except ApiException as exc:
-        _handle_api_exception(exc, "fga_check")
-    return bool(resp.allowed)
+        _handle_api_exception(exc, "fga_batch_check")
+
+    # Per-check evaluation errors come back as allowed=False; surface them instead of denying.
+    errors = [item.error for item in resp.result if item.error is not None]
+    if errors:
+        logger.error("fga_batch_check: OpenFGA check error: %s", errors[0])
+        raise APIException(detail=f"OpenFGA error: {getattr(errors[0], 'message', None) or errors[0]}")
+    return {item.request.relation: bool(item.allowed) for item in resp.result}
 
 
-def fga_check(*, user, relation: str, file: File) -> bool:
+def fga_batch_check(*, user, file: File, relations: list[str]) -> dict[str, bool]:
     """
-    Sync wrapper used in views; Django views are sync by default.
-    Raises APIException on OpenFGA error.
+    Check several relations for one user/file in a single OpenFGA round trip.
+    Returns a mapping of relation -> allowed.
     """
-    return async_to_sync(_fga_check_async)(user=user, relation=relation, file=file)
+    return run_async(_fga_batch_check_async(user=user, file=file, relations=relations))
+
+
+def fga_batch_check_cached(request, *, file: File, relations: list[str]) -> dict[str, bool]:
+    """
+    Per-request memoized fga_batch_check: results are stored on request._fga_cache keyed by
+    (user id, relation, file id), and only relations not checked yet go to OpenFGA.
+    """
+    cache = _request_fga_cache(request)
+    keys = {relation: (request.user.id, relation, file.fga_id) for relation in relations}
+    missing = [relation for relation, key in keys.items() if key not in cache]
+    if missing:
+        results = fga_batch_check(user=request.user, file=file, relations=missing)
+        for relation in missing:
+            cache[keys[relation]] = results.get(relation, False)
+    return {relation: cache[key] for relation, key in keys.items()}
+
+
+def fga_check_cached(request, *, relation: str, file: File) -> bool:
+    """Per-request memoized check of a single relation for the request's user."""
+    return fga_batch_check_cached(request, file=file, relations=[relation])[relation]
 
 
 # -----------------------
 # List objects user can access
 # -----------------------
-async def _fga_list_objects_async(user, relation: str, obj_type: str) -> list[str]:
-    client = get_fga_client()
+async def _fga_list_objects_async(
+    user, relation: str, obj_type: str, client: OpenFgaClient | None = None
+) -> set[str]:
+    # list_objects rather than streamed_list_objects: the SDK's streaming reader drops
+    # error lines and transport failures, which would turn an outage into an empty list.
+    # Note the result is capped at the server's list-objects max results.
+    client = client or await get_fga_client()
     body = ClientListObjectsRequest(
-        user=_fga_user_id(user),
+        user=_fga_user_id(user.id),
         relation=relation,
         type=obj_type
-    )  
+    )
     try:
         resp = await client.list_objects(body)
     except ApiException as exc:
         _handle_api_exception(exc, "fga_list_objects")
-    objects = getattr(resp, "objects", []) or []
-    return [obj.split(":", 1)[1] for obj in objects]
+    return {obj.split(":", 1)[1] for obj in resp.objects or []}
+
+
+def fga_list_viewable_file_ids(user) -> set[str]:
+    """Return the set of file UUIDs the user can view (sync wrapper)."""
+    return run_async(_fga_list_objects_async(user=user, relation=CAN_VIEW, obj_type="file"))
 
 
-def fga_list_viewable_file_ids(user) -> list[str]:
-    """Return list of file UUIDs the user can view (sync wrapper)."""
-    return async_to_sync(_fga_list_objects_async)(user=user, relation=FGARelation.CAN_VIEW.value, obj_type="file")
+def invalidate_request_fga_cache(request) -> None:
+    """Drop cached OpenFGA results for this request after it changes tuples."""
+    request._fga_cache = {}
+
+
+def fga_list_viewable_files(user):
+    """
+    Return the File rows the user can view.
+    The ORM query stays on the calling thread so it uses the request's DB connection.
+    """
+    return _filter_by_uuids(File.objects.all(), fga_list_viewable_file_ids(user))
 
 
 
 # -----------------------
 # Write owner tuple when creating file
 # -----------------------
-async def _fga_write_owner_async(*, user, file: File) -> None:
-    client = get_fga_client()
+async def _fga_write_owner_async(*, user, file: File, client: OpenFgaClient | None = None) -> None:
+    client = client or await get_fga_client()
     body = ClientWriteRequest(
         writes=[
             ClientTuple(
-            user=_fga_user_id(user),
-            relation=FGARelation.OWNER.value,
+            user=_fga_user_id(user.id),
+            relation=OWNER,
             object=_fga_file_id(file),
         )
         ]
@@ -153,37 +319,91 @@ async def _fga_write_owner_async(*, user, file: File) -> None:
 
 
 def fga_write_owner(*, user, file: File) -> None:
-    return async_to_sync(_fga_write_owner_async)(user=user, file=file)
+    run_async(_fga_write_owner_async(user=user, file=file))
+    bump_fga_permissions_version(file.uuid)
 
 
 
 # -----------------------
 # Grant / Revoke relations
 # -----------------------
-async def _fga_apply_write_tuples_async(*, writes: list[ClientTuple]) -> None:
-    client = get_fga_client()
-    body = ClientWriteRequest(writes=writes)
+async def _fga_apply_write_tuples_async(
+    *,
+    writes: list[ClientTuple] | None = None,
+    deletes: list[ClientTuple] | None = None,
+    ignore_missing_deletes: bool = False,
+    client: OpenFgaClient | None = None,
+) -> None:
+    """
+    Write/delete tuples in chunks of FGA_MAX_TUPLES_PER_WRITE, at most FGA_MAX_PARALLEL_WRITES
+    chunks in flight at a time (the SDK's non-transactional write mode).
+    Each chunk is its own OpenFGA transaction, so a failure can leave other chunks applied.
+    With ignore_missing_deletes, deleting a tuple that does not exist is not an error.
+    """
+    client = client or await get_fga_client()
+    body = ClientWriteRequest(writes=writes or None, deletes=deletes or None)
+    options = {
+        "transaction": WriteTransactionOpts(
+            disabled=True,
+            max_per_chunk=settings.FGA_MAX_TUPLES_PER_WRITE,
+            max_parallel_requests=settings.FGA_MAX_PARALLEL_WRITES,
+        )
+    }
+    if ignore_missing_deletes:
+        options["conflict"] = ConflictOptions(on_missing_deletes=ClientWriteRequestOnMissingDeletes.IGNORE)
     try:
-        await client.write(body)
+        resp = await client.write(body, options)
     except ApiException as exc:
+        # The SDK re-raises authentication errors instead of reporting them per tuple.
         _handle_api_exception(exc, "fga_write_tuples")
 
-def fga_grant_relation(*, file: File, assignments: list[dict]) -> None:
-    writes = []
-    for perm in assignments:
-        try:
-            user = User.objects.get(id=perm["user_id"])
-        except User.DoesNotExist:
-            raise ValueError(f"User with uuid {perm['id']} does not exist")
-        
-        writes.append(
-            ClientTuple(
-                user=_fga_user_id(user),
-                relation=perm["relation"],
-                object=_fga_file_id(file),
+    results = (resp.writes or []) + (resp.deletes or [])
+    failures = [res for res in results if not res.success]
+    if not failures:
+        return
+
+    # Per-tuple errors are not necessarily ApiExceptions and are no longer being handled,
+    # so log them with exc_info rather than through _handle_api_exception.
+    exc = failures[0].error
+    if len(failures) < len(results):
+        logger.error(
+            "fga_write_tuples: %d of %d tuples failed: %s", len(failures), len(results), exc, exc_info=exc
+        )
+        raise APIException(
+            detail=(
+                f"OpenFGA error: {len(failures)} of {len(results)} tuples failed, "
+                f"the others were applied: {getattr(exc, 'body', str(exc))}"
             )
         )
-    return async_to_sync(_fga_apply_write_tuples_async)(writes=writes)
+    logger.error("fga_write_tuples: all %d tuples failed: %s", len(results), exc, exc_info=exc)
+    raise APIException(detail=f"OpenFGA error: {getattr(exc, 'body', str(exc))}")
+
+def fga_grant_relation(*, file: File, assignments: list[dict]) -> None:
+    # Normalise the requested ids to primary-key values and validate them in one query.
+    pk_field = User._meta.pk
+    try:
+        user_ids = [pk_field.to_python(perm["user_id"]) for perm in assignments]
+    except ValidationError as exc:
+        raise ValueError(exc.messages[0])
+
+    existing_ids = set(User.objects.filter(pk__in=user_ids).values_list("pk", flat=True))
+    missing_ids = [str(user_id) for user_id in user_ids if user_id not in existing_ids]
+    if missing_ids:
+        raise ValueError(f"User with id {', '.join(missing_ids)} does not exist")
+
+    writes = [
+        ClientTuple(
+            user=_fga_user_id(user_id),
+            relation=perm["relation"],
+            object=_fga_file_id(file),
+        )
+        for user_id, perm in zip(user_ids, assignments)
+    ]
+    try:
+        run_async(_fga_apply_write_tuples_async(writes=writes))
+    finally:
+        # Chunks may have been applied even if another one failed.
+        bump_fga_permissions_version(file.uuid)
 
 
 
@@ -191,8 +411,8 @@ def fga_grant_relation(*, file: File, assignments: list[dict]) -> None:
 # -----------------------
 # List users for a file & relation
 # -----------------------
-async def _fga_list_users_for_file_async(file: File, relation: str) -> list:
-    client = get_fga_client()
+async def _fga_list_users_for_file_async(file: File, relation: str, client: OpenFgaClient | None = None) -> list:
+    client = client or await get_fga_client()
     request = ClientListUsersRequest(
         object=FgaObject(type="file", id=str(file.uuid)),
         relation=relation,
@@ -210,37 +430,56 @@ async def _fga_list_users_for_file_async(file: File, relation: str) -> list:
     for entry in getattr(resp, "users", []) or []:
         obj = getattr(entry, "object", None)
         if obj:
-            users.append(f"user:{obj.id}")
+            users.append(_fga_user_id(obj.id))
     return users
 
 
-def fga_list_file_users(file: File, relation: str) -> list[str]:
-    return async_to_sync(_fga_list_users_for_file_async)(file=file, relation=relation)
+async def _fga_list_users_for_file_multi_async(
+    file: File, relations: list[str], client: OpenFgaClient | None = None
+) -> dict[str, list[str]]:
+    client = client or await get_fga_client()
+    results = await asyncio.gather(
+        *[
+            _fga_list_users_for_file_async(file=file, relation=relation, client=client)
+            for relation in relations
+        ]
+    )
+    return dict(zip(relations, results))
+
+
+def fga_list_file_users_multi(file: File, relations: list[str]) -> dict[str, list[str]]:
+    """
+    List users for several relations concurrently; returns a mapping of relation -> users.
+    """
+    return run_async(_fga_list_users_for_file_multi_async(file=file, relations=relations))
+
+
+def fga_list_file_users_multi_cached(file: File, relations: list[str]) -> dict[str, list[str]]:
+    """
+    fga_list_file_users_multi, cached under the file's current permissions version for
+    FGA_PERMISSIONS_CACHE_TTL seconds.
+    """
+    version = fga_permissions_version(file.uuid)
+    key = f"fga:file-users:{file.uuid}:{version}:{','.join(relations)}"
+    users = cache.get(key)
+    if users is None:
+        users = fga_list_file_users_multi(file=file, relations=relations)
+        cache.set(key, users, settings.FGA_PERMISSIONS_CACHE_TTL)
+    return users
 
 
 
 # -----------------------
 # List relations the user has on an object
 # -----------------------
-async def _fga_list_relations_for_user_file_async(user, file: File):
-    client = get_fga_client()
-    body = ClientListRelationsRequest(
-        user=_fga_user_id(user),
-        object=_fga_file_id(file),
-        relations=[
-            FGARelation.OWNER.value, FGARelation.VIEWER.value, FGARelation.EDITOR.value
-        ]
-    )
-    try:
-        relations_list  = await client.list_relations(body)
-    except ApiException as exc:
-        _handle_api_exception(exc, "fga_list_relations_for_user_file")
-
+async def _fga_list_relations_for_user_file_async(user, file: File, client: OpenFgaClient | None = None):
+    # One /batch-check request; the SDK's list_relations sends a check per relation.
+    results = await _fga_batch_check_async(user=user, file=file, relations=ALL_RELATIONS, client=client)
     return {
-            "user": _fga_user_id(user),
+            "user": _fga_user_id(user.id),
             "object": _fga_file_id(file),
-            "relations": relations_list,
+            "relations": [relation for relation in ALL_RELATIONS if results.get(relation)],
         }
 
 def fga_file_relation_users(user, file: File):
-    return async_to_sync(_fga_list_relations_for_user_file_async)(user=user, file=file)
+    return run_async(_fga_list_relations_for_user_file_async(user=user, file=file))
@@ -1,3 +1,304 @@
-from django.test import TestCase
+import uuid
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from openfga_sdk import ClientConfiguration, OpenFgaClient
+from openfga_sdk.client.models import ClientTuple, ClientWriteResponse
+from openfga_sdk.rest import ApiException
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.test import APIClient
+
+from . import services
+from .models import File
+from filehub.core.fga.loop import run_async
+from filehub.core.fga.relations import CAN_EDIT, CAN_VIEW, EDITOR, OWNER, VIEWER
+
+
+User = get_user_model()
+
+
+def _fake_fga_client(allowed=True):
+    """An OpenFgaClient stand-in: every check answers `allowed`, no tuples are stored."""
+    client = mock.MagicMock()
+    client.batch_check = mock.AsyncMock(
+        side_effect=lambda body, *args, **kwargs: SimpleNamespace(
+            result=[SimpleNamespace(allowed=allowed, error=None, request=check) for check in body.checks]
+        )
+    )
+    client.list_users = mock.AsyncMock(return_value=SimpleNamespace(users=[]))
+    client.read = mock.AsyncMock(return_value=SimpleNamespace(tuples=[], continuation_token=""))
+    client.write = mock.AsyncMock(return_value=ClientWriteResponse())
+    return client
+
+
+class FilePermissionsETagTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="owner", password="x")
+        self.other = User.objects.create_user(username="other", password="x")
+        self.file = File.objects.create(file="uploads/report.txt")
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+        self.fga = _fake_fga_client()
+        patcher = mock.patch("files.services.get_fga_client", mock.AsyncMock(return_value=self.fga))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _get_permissions(self, **headers):
+        return self.api.get(reverse("file-permissions", args=[self.file.uuid]), **headers)
+
+    def test_unchanged_permissions_answer_304_without_fga_calls(self):
+        first = self._get_permissions()
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        etag = first["ETag"]
+        calls = self.fga.list_users.await_count
+
+        second = self._get_permissions(HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(second.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(self.fga.list_users.await_count, calls)
+
+    def test_unknown_file_does_not_create_a_version(self):
+        missing = uuid.uuid4()
+
+        response = self.api.get(reverse("file-permissions", args=[missing]))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIsNone(services.peek_fga_permissions_version(missing))
+
+    def test_share_changes_etag(self):
+        etag = self._get_permissions()["ETag"]
+
+        response = self.api.post(
+            reverse("file-share", args=[self.file.uuid]),
+            {"permissions": [{"user_id": str(self.other.id), "relation": VIEWER}]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        after = self._get_permissions(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(after.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(after["ETag"], etag)
+
+    def test_delete_changes_etag(self):
+        etag = self._get_permissions()["ETag"]
+
+        response = self.api.delete(reverse("file-detail", args=[self.file.uuid]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        self.assertNotEqual(services.fga_permissions_version(self.file.uuid), etag.strip('"'))
+
+
+class FileDetailPermissionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="stranger", password="x")
+        self.file = File.objects.create(file="uploads/report.txt")
+        self.url = reverse("file-detail", args=[self.file.uuid])
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+        patcher = mock.patch(
+            "files.services.get_fga_client", mock.AsyncMock(return_value=_fake_fga_client(allowed=False))
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_without_view_access_looks_like_a_missing_file(self):
+        self.assertEqual(self.api.get(self.url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_edit_and_delete_without_access_are_forbidden(self):
+        self.assertEqual(self.api.put(self.url, {}).status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.api.delete(self.url).status_code, status.HTTP_403_FORBIDDEN)
+        self.assertTrue(File.objects.filter(uuid=self.file.uuid).exists())
+
+
+class ApplyWriteTuplesTests(TestCase):
+    async def _write(self, writes, api_write):
+        client = OpenFgaClient(ClientConfiguration(
+            api_url="http://openfga.test",
+            store_id="01YCP46JKYM8FJCQ37NMBYHE5X",
+            authorization_model_id="01YCP46JKYM8FJCQ37NMBYHE5X",
+        ))
+        client._api.write = api_write
+        try:
+            await services._fga_apply_write_tuples_async(writes=writes, client=client)
+        finally:
+            await client.close()
+
+    def _tuples(self, count):
+        return [ClientTuple(user=f"user:{i}", relation=VIEWER, object="file:f") for i in range(count)]
+
+    @override_settings(FGA_MAX_TUPLES_PER_WRITE=100)
+    def test_writes_are_split_into_chunks(self):
+        api_write = mock.AsyncMock()
+
+        run_async(self._write(self._tuples(250), api_write))
+
+        sizes = [len(call.args[0].writes.tuple_keys) for call in api_write.await_args_list]
+        self.assertEqual(sorted(sizes), [50, 100, 100])
+
+    @override_settings(FGA_MAX_TUPLES_PER_WRITE=100)
+    def test_partial_failure_reports_applied_tuples(self):
+        failed = ApiException(status=400, reason="Bad Request")
+        failed.body = "invalid tuple"
+        api_write = mock.AsyncMock(side_effect=[None, failed, None])
+
+        with self.assertRaises(APIException) as ctx, self.assertLogs("files.services", level="ERROR"):
+            run_async(self._write(self._tuples(250), api_write))
+
+        self.assertEqual(
+            str(ctx.exception.detail),
+            "OpenFGA error: 100 of 250 tuples failed, the others were applied: invalid tuple",
+        )
+
+    def test_total_failure_logs_the_tuple_error(self):
+        failed = ApiException(status=400, reason="Bad Request")
+        failed.body = "invalid tuple"
+        api_write = mock.AsyncMock(side_effect=failed)
+
+        with self.assertRaises(APIException) as ctx, self.assertLogs("files.services", level="ERROR") as logs:
+            run_async(self._write(self._tuples(3), api_write))
+
+        self.assertEqual(str(ctx.exception.detail), "OpenFGA error: invalid tuple")
+        self.assertIs(logs.records[0].exc_info[1], failed)
+
+
+class GrantRelationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="viewer", password="x")
+        self.file = File.objects.create(file="uploads/report.txt")
+        self.fga = _fake_fga_client()
+        patcher = mock.patch("files.services.get_fga_client", mock.AsyncMock(return_value=self.fga))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_rejects_malformed_user_id(self):
+        with self.assertRaises(ValueError):
+            services.fga_grant_relation(file=self.file, assignments=[{"user_id": "abc", "relation": VIEWER}])
+        self.fga.write.assert_not_awaited()
+
+    def test_rejects_missing_user_id(self):
+        missing_id = self.user.id + 1000
+        with self.assertRaisesMessage(ValueError, f"User with id {missing_id} does not exist"):
+            services.fga_grant_relation(
+                file=self.file,
+                assignments=[
+                    {"user_id": str(self.user.id), "relation": VIEWER},
+                    {"user_id": str(missing_id), "relation": VIEWER},
+                ],
+            )
+        self.fga.write.assert_not_awaited()
+
+    def test_writes_one_tuple_per_assignment(self):
+        services.fga_grant_relation(file=self.file, assignments=[{"user_id": str(self.user.id), "relation": VIEWER}])
+
+        body = self.fga.write.await_args.args[0]
+        self.assertEqual(
+            [(t.user, t.relation, t.object) for t in body.writes],
+            [(f"user:{self.user.id}", VIEWER, self.file.fga_id)],
+        )
+
+
+class BatchCheckCachedTests(TestCase):
+    def setUp(self):
+        self.request = SimpleNamespace(user=SimpleNamespace(id=1))
+        self.file = File(file="uploads/report.txt")
+        patcher = mock.patch(
+            "files.services.fga_batch_check",
+            side_effect=lambda *, user, file, relations: {relation: True for relation in relations},
+        )
+        self.batch_check = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_repeated_checks_hit_openfga_once(self):
+        services.fga_batch_check_cached(self.request, file=self.file, relations=[CAN_VIEW])
+        self.assertTrue(services.fga_check_cached(self.request, relation=CAN_VIEW, file=self.file))
+
+        self.batch_check.assert_called_once()
+
+    def test_only_unchecked_relations_are_sent(self):
+        services.fga_batch_check_cached(self.request, file=self.file, relations=[CAN_VIEW])
+        results = services.fga_batch_check_cached(self.request, file=self.file, relations=[CAN_VIEW, CAN_EDIT])
+
+        self.assertEqual(results, {CAN_VIEW: True, CAN_EDIT: True})
+        self.assertEqual(self.batch_check.call_args.kwargs["relations"], [CAN_EDIT])
+
+    def test_invalidate_drops_cached_results(self):
+        services.fga_check_cached(self.request, relation=OWNER, file=self.file)
+        services.invalidate_request_fga_cache(self.request)
+        services.fga_check_cached(self.request, relation=OWNER, file=self.file)
+
+        self.assertEqual(self.batch_check.call_count, 2)
+
+
+def _stored_tuple(user, relation, obj):
+    return SimpleNamespace(key=SimpleNamespace(user=user, relation=relation, object=obj))
+
+
+class DeleteFileTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.file = File.objects.create(file="uploads/report.txt")
+        self.fga = _fake_fga_client()
+        patcher = mock.patch("files.services.get_fga_client", mock.AsyncMock(return_value=self.fga))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _deleted(self):
+        return [
+            [(t.user, t.relation) for t in call.args[0].deletes]
+            for call in self.fga.write.await_args_list
+        ]
+
+    def test_reads_every_page_of_stored_tuples(self):
+        self.fga.read.side_effect = [
+            SimpleNamespace(
+                tuples=[_stored_tuple("user:2", VIEWER, self.file.fga_id)],
+                continuation_token="page-2",
+            ),
+            SimpleNamespace(
+                tuples=[_stored_tuple("user:3", EDITOR, self.file.fga_id)],
+                continuation_token="",
+            ),
+        ]
+
+        services.delete_file(file_instance=self.file)
+
+        self.assertEqual(self.fga.read.await_count, 2)
+        self.assertEqual(self.fga.read.await_args_list[1].args[1]["continuation_token"], "page-2")
+        self.assertEqual(sorted(sum(self._deleted(), [])), [("user:2", VIEWER), ("user:3", EDITOR)])
+
+    def test_owner_tuples_are_deleted_last_in_their_own_write(self):
+        self.fga.read.return_value = SimpleNamespace(
+            tuples=[
+                _stored_tuple("user:1", OWNER, self.file.fga_id),
+                _stored_tuple("user:2", VIEWER, self.file.fga_id),
+            ],
+            continuation_token="",
+        )
+
+        services.delete_file(file_instance=self.file)
+
+        self.assertEqual(self._deleted(), [[("user:2", VIEWER)], [("user:1", OWNER)]])
+        self.assertFalse(File.objects.filter(uuid=self.file.uuid).exists())
+
+    def test_failed_tuple_delete_keeps_the_row_and_its_owner(self):
+        self.fga.read.return_value = SimpleNamespace(
+            tuples=[
+                _stored_tuple("user:1", OWNER, self.file.fga_id),
+                _stored_tuple("user:2", VIEWER, self.file.fga_id),
+            ],
+            continuation_token="",
+        )
+        self.fga.write.side_effect = ApiException(status=500, reason="Internal Server Error")
+
+        with self.assertRaises(APIException), self.assertLogs("files.services", level="ERROR"):
+            services.delete_file(file_instance=self.file)
+
+        self.assertTrue(File.objects.filter(uuid=self.file.uuid).exists())
+        self.assertEqual(self._deleted(), [[("user:2", VIEWER)]])
@@ -1,11 +1,16 @@
+from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.utils.http import quote_etag
+from django.views.decorators.http import condition
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import generics, permissions, status
+from rest_framework.exceptions import NotFound, PermissionDenied
 from rest_framework.parsers import MultiPartParser, FormParser
 
 from . import services
 from .models import File
-from filehub.core.fga.relations import FGARelation
+from filehub.core.fga.relations import CAN_EDIT, CAN_VIEW, EDITOR, OWNER, VIEWER
 from .serializers import FileSerializer, FileShareSerializer
 
 
@@ -20,9 +25,7 @@ class FileListCreateView(generics.ListCreateAPIView):
     parser_classes = [MultiPartParser, FormParser]
 
     def get_queryset(self):
-        user = self.request.user
-        allowed_file_ids = services.fga_list_viewable_file_ids(user)
-        return File.objects.filter(uuid__in=allowed_file_ids)
+        return services.fga_list_viewable_files(self.request.user)
 
     def perform_create(self, serializer):
         file_instance = serializer.save()
@@ -30,6 +33,7 @@ class FileListCreateView(generics.ListCreateAPIView):
             user=self.request.user,
             file=file_instance,
         )
+        services.invalidate_request_fga_cache(self.request)
 
 class FileDetailView(generics.RetrieveUpdateDestroyAPIView):
     """
@@ -43,30 +47,36 @@ class FileDetailView(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [permissions.IsAuthenticated]
     lookup_field = "uuid"
 
-    def get_queryset(self):
-        if self.request.method == "GET":
-            user = self.request.user
-            allowed_file_ids = services.fga_list_viewable_file_ids(user)
-            return File.objects.filter(uuid__in=allowed_file_ids)
+    # Relations the caller must hold on the file for each HTTP method.
+    method_relations = {
+        "GET": [CAN_VIEW],
+        "HEAD": [CAN_VIEW],
+        "OPTIONS": [CAN_VIEW],
+        "PUT": [CAN_EDIT],
+        "PATCH": [CAN_EDIT],
+        "DELETE": [OWNER],
+    }
 
+    def get_queryset(self):
+        # Authorization happens per object in get_object; a single check is cheaper
+        # than listing every file the user can view.
         return File.objects.all()
 
     def get_object(self):
         obj = super().get_object()
-        user = self.request.user
-        method = self.request.method
-
-        if method in ("GET", "HEAD", "OPTIONS"):
-            allowed = services.fga_check(user=user, relation=FGARelation.CAN_VIEW.value, file=obj)
-        elif method in ("PUT", "PATCH"):
-            allowed = services.fga_check(user=user, relation=FGARelation.CAN_EDIT.value, file=obj)
-        elif method == "DELETE":
-            allowed = services.fga_check(user=user, relation=FGARelation.OWNER.value, file=obj)
+        relations = self.method_relations.get(self.request.method)
+
+        if relations:
+            results = services.fga_batch_check_cached(self.request, file=obj, relations=relations)
+            allowed = all(results.values())
         else:
             allowed = False
 
         if not allowed:
-            from rest_framework.exceptions import PermissionDenied
+            # Callers who cannot view the file get the same 404 as for a missing UUID,
+            # so the response does not reveal which files exist.
+            if not relations or CAN_VIEW in relations:
+                raise NotFound()
             raise PermissionDenied("You do not have permission to access this file.")
 
         return obj
@@ -89,6 +99,7 @@ class FileDetailView(generics.RetrieveUpdateDestroyAPIView):
 
     def perform_destroy(self, instance):
         services.delete_file( file_instance=instance)
+        services.invalidate_request_fga_cache(self.request)
 
 
 class FileShareView(APIView):
@@ -106,16 +117,10 @@ class FileShareView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request, uuid):
-        try:
-            file_instance = File.objects.get(uuid=uuid)
-        except File.DoesNotExist:
-            return Response(
-                {"detail": "File not found."},
-                status=status.HTTP_404_NOT_FOUND,
-            )
+        file_instance = get_object_or_404(File.objects.only("uuid"), uuid=uuid)
 
         # Ensure caller is allowed to share (e.g. must be 'owner')
-        if not services.fga_check(user=request.user, relation=FGARelation.OWNER.value, file=file_instance):
+        if not services.fga_check_cached(request, relation=OWNER, file=file_instance):
             return Response(
                 {"detail": "You do not have permission to share this file."},
                 status=status.HTTP_403_FORBIDDEN,
@@ -131,50 +136,50 @@ class FileShareView(APIView):
             )
         except ValueError as e:
             return Response({"detail": str(e)}, status=400)
+        services.invalidate_request_fga_cache(request)
 
         return Response({"detail": "File shared successfully."}, status=status.HTTP_200_OK)
 
 
+def _permissions_etag(request, uuid):
+    # Read-only: a version is only created once the view has found the file, so
+    # requests for made-up UUIDs do not add cache entries.
+    return services.peek_fga_permissions_version(uuid)
+
+
 class FilePermissionsView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    # Unchanged permissions answer If-None-Match with 304 before any FGA call.
+    @method_decorator(condition(etag_func=_permissions_etag))
     def get(self, request, uuid):
-        try:
-            file_instance = File.objects.get(uuid=uuid)
-        except File.DoesNotExist:
-            return Response({"detail": "File not found."}, status=404)
+        file_instance = get_object_or_404(File.objects.only("uuid"), uuid=uuid)
+        etag = quote_etag(services.fga_permissions_version(file_instance.uuid))
 
-        owners = services.fga_list_file_users(
-            file=file_instance,
-            relation=FGARelation.OWNER.value
-        )
-        viewers = services.fga_list_file_users(
+        users = services.fga_list_file_users_multi_cached(
             file=file_instance,
-            relation=FGARelation.VIEWER.value
-        )
-        editors = services.fga_list_file_users(
-            file=file_instance,
-            relation=FGARelation.EDITOR.value
+            relations=[
+                OWNER,
+                VIEWER,
+                EDITOR,
+            ],
         )
 
         return Response({
             "file": str(uuid),
             "permissions": {
-                "owners": owners,
-                "viewers": viewers,
-                "editors": editors
+                "owners": users[OWNER],
+                "viewers": users[VIEWER],
+                "editors": users[EDITOR]
             }
-        })
+        }, headers={"ETag": etag})
 
 
 class FileRelations(APIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def get(self, request, uuid):
-        try:
-            file_instance = File.objects.get(uuid=uuid)
-        except File.DoesNotExist:
-            return Response({"detail": "File not found."}, status=404)
+        file_instance = get_object_or_404(File.objects.only("uuid"), uuid=uuid)
         
         data  = services.fga_file_relation_users(user=self.request.user, file=file_instance )
 